@@ -0,0 +1,46 @@
+# cython: language_level=3
+'''Cython implementation of the bitfield extraction. This is an optional
+accelerator, pybinmap falls back to pure Python if it is not compiled.'''
+
+import sys
+
+from libc.string cimport memcpy
+
+
+# 8 byte words can be loaded directly only on little endian hosts
+cdef bint _LITTLE_HOST = sys.byteorder == 'little'
+
+
+cpdef unsigned long long extract(
+        const unsigned char[::1] buf, Py_ssize_t bit_start, Py_ssize_t bit_len
+        ) except? 0:
+    '''Return the value of the bitfield with the given start address and length
+    in buf. The bitfield must fit into 64 bits including its bit offset in the
+    first byte.'''
+
+    cdef Py_ssize_t byte_pos = bit_start >> 3
+    cdef Py_ssize_t shift = bit_start & 7
+    cdef Py_ssize_t nbytes = (shift + bit_len + 7) >> 3
+    cdef unsigned long long val = 0
+    cdef Py_ssize_t k
+
+    if (bit_start < 0) or (bit_len < 1) or (shift + bit_len > 64):
+        raise ValueError('Bitfield does not fit into 64 bits.')
+
+    if byte_pos + nbytes > buf.shape[0]:
+        raise ValueError('Data too short for bitfield.')
+
+    if _LITTLE_HOST and (byte_pos + 8 <= buf.shape[0]):
+        # load a whole word, the surplus bits are masked below
+        memcpy(&val, &buf[byte_pos], 8)
+    else:
+        for k in range(nbytes):
+            val |= (<unsigned long long>buf[byte_pos + k]) << (8 * k)
+
+    val >>= shift
+
+    # shifting a 64 bit integer by 64 bits is undefined
+    if bit_len < 64:
+        val &= ((<unsigned long long>1) << bit_len) - 1
+
+    return val
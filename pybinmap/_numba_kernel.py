@@ -0,0 +1,53 @@
+'''Numba compiled kernel to extract many unaligned bitfields in one call. This
+is an optional accelerator for BinMap.compile(). Importing this module raises
+ImportError if numba or numpy are not installed.'''
+
+# numpy and numba are optional dependencies
+import numpy as np  # pylint: disable=import-error
+from numba import njit  # pylint: disable=import-error
+
+
+@njit(cache=True)
+def extract_bits(buf, bit_start, bit_len):
+    '''Return the value of the bitfield with the given start address and length
+    in buf. The bitfield must fit into 64 bits including its bit offset in the
+    first byte.'''
+
+    byte_pos = bit_start >> 3
+    shift = bit_start & 7
+    nbytes = (shift + bit_len + 7) >> 3
+
+    val = np.uint64(0)
+    for k in range(nbytes):
+        val |= np.uint64(buf[byte_pos + k]) << np.uint64(8 * k)
+
+    # shifting a 64 bit integer by 64 bits is undefined
+    if bit_len == 64:
+        return val
+
+    mask = (np.uint64(1) << np.uint64(bit_len)) - np.uint64(1)
+    return (val >> np.uint64(shift)) & mask
+
+
+@njit(cache=True)
+def extract_all(data, starts, lengths, out):
+    '''Extract the bitfields given by start and length arrays from data and store
+    their values in out.'''
+
+    for i in range(starts.shape[0]):
+        out[i] = extract_bits(data, starts[i], lengths[i])
+
+
+def compile_bitfields(starts, lengths):
+    '''Return a function which extracts the given bitfields from data and returns
+    a list of their integer values.'''
+
+    starts = np.array(starts, dtype=np.int64)
+    lengths = np.array(lengths, dtype=np.int64)
+    out = np.zeros(starts.shape[0], dtype=np.uint64)
+
+    def extract(data):
+        extract_all(np.frombuffer(data, dtype=np.uint8), starts, lengths, out)
+        return out.tolist()
+
+    return extract
@@ -1,9 +1,81 @@
 '''Implementation of the BinMap class for mapping binary data to meaningful
 fields.'''
 
-from collections import OrderedDict
+import array
+import bisect
+import struct
+import sys
+
+from .dataitems import (
+    _UNSET, DataItem, UIntDataItem, FastUIntDataItem, CharDataItem, BoolDataItem,
+    FloatDataItem)
+
+# data type table for mapping names to DataItem classes and default arguments
+_DT_REGISTRY = {
+    'raw': (DataItem, {}),
+    'uint': (UIntDataItem, {}),
+    'uint8': (UIntDataItem, {'length': 8}),
+    'uint16': (UIntDataItem, {'length': 16}),
+    'uint32': (UIntDataItem, {'length': 32}),
+    'uint64': (UIntDataItem, {'length': 64}),
+    'ascii': (CharDataItem, {'encoding': 'ascii'}),
+    'utf8': (CharDataItem, {'encoding': 'utf-8'}),
+    'bool': (BoolDataItem, {}),
+    'bool1': (BoolDataItem, {'length': 1}),
+    'bool8': (BoolDataItem, {'length': 8}),
+    'float': (FloatDataItem, {'length': 32}),
+    'double': (FloatDataItem, {'length': 64}),
+}
+
+# specialized DataItem classes for data types with byte-aligned start and
+# fitting length
+_ALIGNED_DT_REGISTRY = {
+    'uint': FastUIntDataItem,
+    'uint8': FastUIntDataItem,
+    'uint16': FastUIntDataItem,
+    'uint32': FastUIntDataItem,
+    'uint64': FastUIntDataItem,
+}
+
+
+def _intern(value):
+    '''Return the interned version of value if it is a string, otherwise value
+    itself, e.g. for integer item names.'''
+
+    if isinstance(value, str):
+        return sys.intern(value)
+
+    return value
+
+
+def _import_numba_kernel():
+    '''Return the numba bitfield kernel module or None if numba is not
+    available.'''
+
+    try:
+        from . import _numba_kernel
+    except ImportError:
+        return None
+
+    return _numba_kernel
+
+
+def _compile_bitfields(starts, lengths):
+    '''Pure Python counterpart to the compile_bitfields() function of the numba
+    kernel. Returns a function which extracts the given bitfields from data and
+    returns a list of their integer values.'''
+
+    fields = [
+        (start >> 3, (start + length + 7) >> 3, start & 7, (1 << length) - 1)
+        for start, length in zip(starts, lengths)]
+
+    def extract(data):
+        return [
+            (int.from_bytes(data[byte_start:byte_end], 'little') >> shift) & mask
+            for byte_start, byte_end, shift, mask in fields]
+
+    return extract
 
-from .dataitems import DataItem, UIntDataItem, CharDataItem, BoolDataItem
 
 class BinMap():
     '''The BinMap organized a set of data items to interpret unstructured binary
@@ -14,29 +86,49 @@ class BinMap():
 
         # a list for maintaining sort order of the items
         self._map_list = []
+        # start addresses of the items in _map_list for bisecting
+        self._starts = []
         # a dict for name based access
         self._map_dict = {}
         # interpreted data
         self._data = None
 
-        # type table for mapping names to DataItem classes and default arguments
-        self._type_tbl = {
-            'raw': {'cls': DataItem},
-            'uint': {'cls': UIntDataItem},
-            'uint8': {'cls': UIntDataItem, 'length': 8},
-            'uint16': {'cls': UIntDataItem, 'length': 16},
-            'uint32': {'cls': UIntDataItem, 'length': 32},
-            'uint64': {'cls': UIntDataItem, 'length': 64},
-            'ascii': {'cls': CharDataItem, 'encoding': 'ascii'},
-            'utf8': {'cls': CharDataItem, 'encoding': 'utf-8'},
-            'bool': {'cls': BoolDataItem},
-            'bool1': {'cls': BoolDataItem, 'length': 1},
-            'bool8': {'cls': BoolDataItem, 'length': 8},
-        }
-
         # helper counter to fill unmapped regions
         self._unmapped_counter = 0
 
+        # compiled struct for unpacking many items at once, see compile()
+        self._struct = None
+        # items unpacked by the compiled struct, in format order
+        self._field_items = []
+        # unaligned items, their start and length arrays and the function to
+        # extract all of them
+        self._bit_items = []
+        self._bit_starts = array.array('q')
+        self._bit_lengths = array.array('q')
+        self._extract_bits = None
+        # (item, extractor function) tuples for the items which are neither
+        # covered by the compiled struct nor by the bitfield extraction
+        self._extractors = []
+        # minimum data length in bytes for the compiled items
+        self._compiled_len = 0
+
+        # generated function returning the values of all items, see freeze()
+        self._unpack = None
+        # minimum data length in bytes for the generated function
+        self._frozen_len = 0
+        # values returned by the generated function for the current data, in
+        # the order of the item list
+        self._values = None
+        # names of the items in the order of the generated values
+        self._frozen_names = []
+        # position of the value for each name in the generated values
+        self._frozen_index = {}
+        # data passed to a frozen BinMap, interpreted by the items on access
+        self._frozen_data = None
+        # incremented by each set_data() call, items of a frozen BinMap compare
+        # it with their own version to find out if they are up to date
+        self._version = 0
+
 
     def add(self, **kwargs):
         '''Add a new data item definition to this binary map.
@@ -49,28 +141,39 @@ class BinMap():
 
         '''
 
+        self._add_item(self._create_item(**kwargs))
+
+
+    def _create_item(self, **kwargs):
+        '''Create a DataItem instance from the keyword arguments passed to add().'''
+
         # At least we need the data type.
         if 'dt' not in kwargs:
             raise ValueError("Data type must be specified with 'dt' parameter.")
 
-        spec = self._type_tbl[kwargs['dt']]
+        # Interned strings make the lookups in the type tables and the name dict
+        # compare by identity.
+        dt = _intern(kwargs['dt'])
+        cls, defaults = _DT_REGISTRY[dt]
 
-        kwargs.update(spec)
+        # the data type defaults take precedence over the passed arguments
+        args = {**kwargs, **defaults}
+        args['dt'] = dt
+        if 'name' in args:
+            args['name'] = _intern(args['name'])
 
-        # we do not pass on the class
-        del kwargs['cls']
+        aligned_cls = _ALIGNED_DT_REGISTRY.get(dt)
+        if (aligned_cls is not None) and aligned_cls.fits(
+                args.get('start'), args.get('length')):
+            cls = aligned_cls
 
-        cls = spec['cls']
-        item = cls(**kwargs)
-
-        self._add_item(item)
+        return cls(**args)
 
 
     def add_from_spec(self, spec):
         '''Use a list of dict structure to specify data items to add.'''
 
-        for item in spec:
-            self.add(**item)
+        self._add_items([self._create_item(**item) for item in spec])
 
 
     def get_spec(self):
@@ -85,57 +188,312 @@ class BinMap():
         '''Add a DataItem instance.'''
 
         self._map_dict[item.name] = item
-        self._map_list.append(item)
 
         # TODO: Check for overlapping
 
-        # keep the list sorted by start address
+        self._discard_compiled()
+
+        # keep the list sorted by start address, after items with the same start
+        pos = bisect.bisect_right(self._starts, item.start)
+        self._starts.insert(pos, item.start)
+        self._map_list.insert(pos, item)
+
+
+    def _discard_compiled(self):
+        '''Discard the results of compile() and freeze(), which do not know about
+        items added afterwards.'''
+
+        # items added afterwards never saw the frozen data
+        self._sync_items()
+        self._frozen_data = None
+
+        if self._unpack is not None:
+            for item in self._map_list:
+                item._binmap = None
+
+        self._struct = None
+        self._unpack = None
+        self._values = None
+
+
+    def _add_items(self, items):
+        '''Add many DataItem instances and sort the list only once.'''
+
+        self._discard_compiled()
+
+        for item in items:
+            self._map_dict[item.name] = item
+
+        self._map_list.extend(items)
         self._map_list.sort(key=lambda item: item.start)
+        self._starts = [item.start for item in self._map_list]
+
+
+    def compile(self):
+        '''Compile a struct format to unpack all byte-aligned fixed-width items in
+        a single call to set_data(). Unaligned bitfields are extracted together
+        from parallel start and length arrays, by a compiled kernel if numba is
+        installed. All other items, e.g. strings, get an extractor function with
+        their byte range as constants, which skips the per-item method calls of
+        DataItem.set_data().
+
+        Adding items after calling compile() discards the compiled format, so
+        compile() has to be called again.
+
+        '''
+
+        fmt = ['<']
+        field_items = []
+        other_items = []
+
+        # byte position up to which the format covers the data
+        pos = 0
+
+        for item in self._map_list:
+            code = item._get_struct_code()
+
+            # the format cannot go backwards for overlapping items
+            if (code is None) or (item._byte_start < pos):
+                other_items.append(item)
+                continue
+
+            gap = item._byte_start - pos
+            if gap > 0:
+                fmt.append('{0}x'.format(gap))
+
+            fmt.append(code)
+            field_items.append(item)
+            pos = item._byte_end
+
+        self._struct = struct.Struct(''.join(fmt))
+        self._field_items = field_items
+
+        # Unaligned bitfields are kept as parallel start / length arrays and
+        # extracted in one call, by the numba kernel if available.
+        kernel = _import_numba_kernel()
+        if kernel is not None:
+            compile_bitfields = kernel.compile_bitfields
+            # the kernel works on 64 bit words, including the bit offset
+            max_bits = 64
+        else:
+            compile_bitfields = _compile_bitfields
+            max_bits = None
+
+        def is_bitfield(item):
+            return not item._is_aligned and (
+                (max_bits is None) or (item._shift + item.length <= max_bits))
+
+        bit_items = [item for item in other_items if is_bitfield(item)]
+        other_items = [item for item in other_items if not is_bitfield(item)]
+
+        self._bit_items = bit_items
+        self._extract_bits = None
+        if bit_items:
+            self._bit_starts = array.array('q', (item.start for item in bit_items))
+            self._bit_lengths = array.array('q', (item.length for item in bit_items))
+            self._extract_bits = compile_bitfields(self._bit_starts, self._bit_lengths)
+
+        self._extractors = [(item, item._make_extractor()) for item in other_items]
+
+        self._compiled_len = max(
+            (item._byte_end for item in self._map_list), default=0)
+
+
+    def freeze(self):
+        '''Generate a Python function which calculates the values of all items
+        with the start address, length and data type of each item as constants.
+        After calling freeze(), set_data() only calls this function. The items
+        themselves interpret the data only when they are accessed, e.g. with
+        their value or raw_value properties.
+
+        Adding items after calling freeze() discards the generated function, so
+        freeze() has to be called again.
+
+        '''
+
+        # The names are not part of the source, as they might not have a valid
+        # literal representation. The function returns a tuple of the values
+        # in the order of the item list instead.
+        namespace = {}
+        lines = ['def unpack(data):', '    return (']
+        for item in self._map_list:
+            lines.append('        {0},'.format(item._get_source(namespace)))
+        lines.append('    )')
+
+        code = compile('\n'.join(lines), '<BinMap.freeze>', 'exec')
+        exec(code, namespace)  # pylint: disable=exec-used
+
+        self._unpack = namespace['unpack']
+        self._frozen_names = [item.name for item in self._map_list]
+
+        # like __getitem__ of an unfrozen BinMap, duplicate names refer to the
+        # item added last
+        positions = {item: pos for pos, item in enumerate(self._map_list)}
+        self._frozen_index = {
+            name: positions[item] for name, item in self._map_dict.items()}
+
+        # the items fetch the data from this BinMap when they are accessed
+        for item in self._map_list:
+            item._binmap = self
+
+        self._frozen_len = max((item._byte_end for item in self._map_list), default=0)
+        self._values = None
+
+
+    def _sync_item(self, item):
+        '''Let an item interpret the data passed to a frozen BinMap, unless it
+        already did.'''
+
+        if (self._frozen_data is not None) and (item._version != self._version):
+            item.set_data(self._frozen_data)
+            item._version = self._version
+
+
+    def _sync_items(self):
+        '''Let all items interpret the data passed to a frozen BinMap.'''
+
+        if self._frozen_data is None:
+            return
+
+        for item in self._map_list:
+            self._sync_item(item)
 
 
     def set_data(self, data):
         '''Set the data to be interpreted.
 
-        :param data: A bytes() object containing the data to be interpreted.'''
+        :param data: A bytes() object containing the data to be interpreted. Other
+          objects supporting the buffer protocol, e.g. array.array or mmap, and
+          sequences of byte values, e.g. a list of ints, are accepted as well.
+          They are copied once, so later changes to them do not affect the
+          interpreted values.'''
+
+        # Copy other buffers once instead of keeping a view on them in the
+        # items, which would keep e.g. an mmap from being closed or an
+        # array.array from being resized. Items interpret the data lazily, so
+        # mutable buffers like a reused bytearray must be copied as well.
+        if not isinstance(data, bytes):
+            try:
+                view = memoryview(data)
+            except TypeError:
+                # e.g. a list of byte values, iter() rejects a plain int which
+                # bytes() would take as length
+                data = bytes(iter(data))
+            else:
+                with view:
+                    data = view.tobytes()
+
+        self._version += 1
+
+        if (self._unpack is not None) and (len(data) >= self._frozen_len):
+            self._values = self._unpack(data)
+            self._frozen_data = data
+            return
+
+        self._values = None
+        self._frozen_data = None
+
+        # Too short data is handled by the items to report which item is
+        # affected.
+        if (self._struct is None) or (len(data) < self._compiled_len):
+            for item in self._map_list:
+                item.set_data(data)
+
+            return
+
+        values = self._struct.unpack_from(data)
+        for item, value in zip(self._field_items, values):
+            item._set_value(data, value)
+
+        if self._extract_bits is not None:
+            bit_values = self._extract_bits(data)
+            for item, bits in zip(self._bit_items, bit_values):
+                item._set_bits(data, bits)
+
+        for item, extract in self._extractors:
+            item._set_value(data, extract(data))
+
+
+    def values_as_ndarray(self, data):
+        '''Interpret data as NumPy structured array with one field per byte-aligned
+        fixed-width numeric item, i.e. uint8/16/32/64, float and double. Other
+        items are not included. The array is a view on data, nothing is copied.
+
+        data may contain several consecutive records. The record size is given
+        by the end of the last item, so the array contains one element per
+        record. This requires NumPy to be installed.
+
+        :param data: A bytes() object or other object supporting the buffer
+          protocol containing one or more records.
+
+        '''
 
+        import numpy as np  # pylint: disable=import-outside-toplevel,import-error
+
+        names = []
+        formats = []
+        offsets = []
         for item in self._map_list:
-            item.set_data(data)
+            dtype = item._get_dtype()
+            if dtype is not None:
+                names.append(item.name)
+                formats.append(dtype)
+                offsets.append(item._byte_start)
+
+        record_dtype = np.dtype({
+            'names': names,
+            'formats': formats,
+            'offsets': offsets,
+            'itemsize': max((item._byte_end for item in self._map_list), default=0),
+        })
+
+        return np.frombuffer(data, dtype=record_dtype)
 
 
     def get_value_dict(self):
-        '''Return an ordered dictionary containing mapping the data item names to their
-        values. The dict is ordered by start address of the data items.
+        '''Return a dictionary mapping the data item names to their values. The dict
+        is ordered by start address of the data items.
 
         '''
 
-        odict = OrderedDict()
-        for item in self._map_list:
-            odict[item.get_name()] = item.get_value()
+        if self._values is not None:
+            return dict(zip(self._frozen_names, self._values))
 
-        return odict
+        return {item.name: item.value for item in self._map_list}
 
 
     def get_value(self, name):
         '''Return the value of a data item by its name.'''
 
-        return self._map_dict[name].value
+        return self[name]
 
 
     def __getitem__(self, key):
         '''Index based access to values.'''
 
-        return self._map_dict[key].value
+        if self._values is not None:
+            return self._values[self._frozen_index[key]]
+
+        value = self._map_dict[key]._value
+        if value is _UNSET:
+            raise ValueError('No data set.')
+
+        return value
 
 
     def get_item(self, name):
         '''Returns the underlying DataItem instance for the given name.'''
-        return self._map_dict[name]
 
+        item = self._map_dict[name]
+        self._sync_item(item)
 
-    def _add_unmapped(self, start, end):
-        '''Add a 'raw' data item for the given address range.'''
+        return item
 
-        self.add(
+
+    def _create_unmapped(self, start, end):
+        '''Create a 'raw' data item for the given address range.'''
+
+        item = self._create_item(
             dt='raw',
             name='unmapped_{:03}'.format(self._unmapped_counter),
             start=start,
@@ -143,6 +501,8 @@ class BinMap():
 
         self._unmapped_counter += 1
 
+        return item
+
 
     def fill_unmapped(self, end_addr=None):
         '''Fill all unmapped areas 'raw' type mappings.
@@ -156,27 +516,40 @@ class BinMap():
 
         '''
 
-        if self._map_list[0].start > 0:
-            self._add_unmapped(0, self._map_list[0].start - 1)
+        # collect all gaps first to sort the item list only once
+        new_items = []
+
+        # Sweep over the sorted items. cursor is the first address not covered
+        # by any item seen so far, also if items overlap or contain each other.
+        cursor = 0
+        for item in self._map_list:
+            if item.start > cursor:
+                new_items.append(self._create_unmapped(cursor, item.start - 1))
 
-        for (di1, di2) in zip(self._map_list[:-1], self._map_list[1:]):
-            if di1.end + 1 < di2.start:
-                self._add_unmapped(di1.end + 1, di2.start - 1)
+            cursor = max(cursor, item.end + 1)
 
-        if (end_addr is not None) and (end_addr > self._map_list[-1].end):
-            self._add_unmapped(self._map_list[-1].end + 1, end_addr)
+        if (end_addr is not None) and (end_addr >= cursor):
+            new_items.append(self._create_unmapped(cursor, end_addr))
+
+        self._add_items(new_items)
 
 
     def __str__(self):
         '''Convert the whole binmap to string, i.e. print the information from all
         contained data items.'''
 
-        return '\n'.join(str(bd) for bd in self._map_list)
+        self._sync_items()
+
+        return '\n'.join([str(bd) for bd in self._map_list])
 
 
     def __iter__(self):
         '''Iterate over the (key, value) tuples.'''
 
+        if self._values is not None:
+            yield from zip(self._frozen_names, self._values)
+            return
+
         for item in self._map_list:
             yield (item.name, item.value)
 
@@ -185,4 +558,6 @@ class BinMap():
         '''Return an iterator to iterate over the underlying DataItem instances
         in this BinMap.'''
 
+        self._sync_items()
+
         return self._map_list.__iter__()
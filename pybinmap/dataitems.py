@@ -1,6 +1,39 @@
 '''Implementation of DataItem class and subclasses to convert binary data to a
 meaningful representation.'''
 
+import struct
+
+try:
+    from ._bitops import extract as _extract_bits
+except ImportError:
+    # the Cython extension is optional
+    _extract_bits = None
+
+
+# sentinel for the value of data items without data
+_UNSET = object()
+
+# struct format codes of unsigned integers by length in bits
+_UINT_CODES = {8: 'B', 16: 'H', 32: 'I', 64: 'Q'}
+
+# unpack_from methods of precompiled structs by length in bits and endian
+_UINT_UNPACKERS = {
+    (length, endian): struct.Struct(byte_order + code).unpack_from
+    for length, code in _UINT_CODES.items()
+    for endian, byte_order in (('little', '<'), ('big', '>'))
+}
+
+# struct format codes of floating point numbers by length in bits
+_FLOAT_CODES = {32: 'f', 64: 'd'}
+
+# precompiled structs of floating point numbers by length in bits and endian
+_FLOAT_STRUCTS = {
+    (length, endian): struct.Struct(byte_order + code)
+    for length, code in _FLOAT_CODES.items()
+    for endian, byte_order in (('little', '<'), ('big', '>'))
+}
+
+
 def format_addr(addr):
     '''Format a bit address as byte / bit address string.'''
 
@@ -11,12 +44,28 @@ def format_addr(addr):
         bit=bit)
 
 
+def check_endian(endian):
+    '''Raise a ValueError if endian is neither 'big' nor 'little'.'''
+
+    if endian not in ('little', 'big'):
+        msg = (
+            "Parameter 'endian' must be either 'big' or 'little' endian. "
+            "Got '{0}'."
+        )
+        raise ValueError(msg.format(endian))
+
+
 class DataItem():
     '''Base class for binary data extraction. This one just extracts a raw byte
     array. Needs to be subclassed to interpret data.
 
     '''
 
+    __slots__ = (
+        '_args', '_name', '_start', '_length', '_end', '_byte_start', '_byte_end',
+        '_slice', '_is_aligned', '_shift', '_raw_len', '_mask', '_str_prefix',
+        '_raw_value', '_value', '_data', '_set', '_version', '_binmap')
+
     def __init__(self, **kwargs):
         self._args = kwargs
 
@@ -24,28 +73,158 @@ class DataItem():
         self._name = kwargs['name']
         self._start = kwargs['start']
         self._length = kwargs['length']
+        self._end = self._start + self._length - 1
+
+        # byte range covering this item, used for the byte-aligned fast path
+        self._byte_start = self._start >> 3
+        self._byte_end = (self._start + self._length + 7) >> 3
+        self._slice = slice(self._byte_start, self._byte_end)
+        self._is_aligned = (self._start % 8 == 0) and (self._length % 8 == 0)
+
+        # bit offset in the first byte, length of the raw value in bytes and
+        # mask for extracting unaligned bitfields
+        self._shift = self._start & 7
+        self._raw_len = (self._length + 7) >> 3
+        self._mask = (1 << self._length) - 1
+
+        # constant part of the string conversion, see __str__()
+        self._str_prefix = '{addr}+{length} {name} = '.format(
+            addr=format_addr(self._start),
+            length=self._length,
+            name=self._name)
 
         self._raw_value = None
-        self._value = None
+        self._value = _UNSET
 
         self._data = None
+        # True once data is set
+        self._set = False
+        # version of the BinMap data interpreted by this item, see BinMap
+        self._version = -1
+        # frozen BinMap which passes its data to this item on access
+        self._binmap = None
 
 
     def set_data(self, data):
         '''Sets the data to interpret. Calling this function already interprets the
         data.
 
-        :param data: bytes object containing the data to be interpreted.
+        :param data: bytes object or memoryview containing the data to be
+          interpreted.
 
         '''
 
-        endbyte = self.end // 8
-        if len(data) < endbyte + 1:
-            raise ValueError("Data too short in data item '{0}'.".format(self.name))
+        self._check_data(data)
 
         self._data = data
         self._raw_value = self.extract_raw_value()
         self._value = self.calc_value()
+        self._set = True
+
+
+    def _set_value(self, data, value):
+        '''Set an already calculated value, e.g. from a compiled BinMap. The raw
+        value is extracted on request, unless data is mutable.'''
+
+        self._data = data
+        self._raw_value = None
+        self._value = value
+        self._set = True
+
+        # a lazily extracted raw value must not see later changes of the data
+        if not isinstance(data, bytes):
+            self._raw_value = self.extract_raw_value()
+
+
+    def _set_bits(self, data, bits):
+        '''Set the raw value from the integer value of the bitfield, e.g. as
+        extracted by a compiled BinMap.'''
+
+        self._data = data
+        self._raw_value = bits.to_bytes(self._raw_len, 'little')
+        self._value = self.calc_value()
+        self._set = True
+
+
+    def _get_struct_code(self):
+        '''Return the struct format code which unpacks the value of this item or
+        None if the item cannot be unpacked by the struct module. The code is
+        used with little-endian, standard size byte order.'''
+
+        if self._is_aligned:
+            return '{0}s'.format(self._byte_end - self._byte_start)
+
+        return None
+
+
+    def _get_int_source(self):
+        '''Return a Python expression which calculates the bits of this item as
+        little-endian integer from 'data'.'''
+
+        nbytes = self._byte_end - self._byte_start
+
+        if self._is_aligned and (nbytes == 1):
+            return 'data[{0}]'.format(self._byte_start)
+
+        if self._is_aligned and (nbytes == 2):
+            return '(data[{0}] | (data[{1}] << 8))'.format(
+                self._byte_start, self._byte_start + 1)
+
+        if self._is_aligned:
+            return "int.from_bytes(data[{0}:{1}], 'little')".format(
+                self._byte_start, self._byte_end)
+
+        return "((int.from_bytes(data[{0}:{1}], 'little') >> {2}) & {3:#x})".format(
+            self._byte_start, self._byte_end, self._shift, self._mask)
+
+
+    def _get_raw_source(self):
+        '''Return a Python expression which calculates the raw value of this item
+        from 'data'.'''
+
+        if self._is_aligned:
+            return 'bytes(data[{0}:{1}])'.format(self._byte_start, self._byte_end)
+
+        return "{0}.to_bytes({1}, 'little')".format(
+            self._get_int_source(), self._raw_len)
+
+
+    def _get_source(self, namespace):
+        '''Return a Python expression which calculates the value of this item from
+        'data'. This is used by BinMap.freeze() to generate an unpack function.
+
+        :param namespace: Dict of global names for the generated function.
+          Objects the expression refers to are added to it.
+
+        '''
+
+        return self._get_raw_source()
+
+
+    def _make_extractor(self):
+        '''Return a function which calculates the value of this item from data.
+        The function is compiled from the expression returned by _get_source(),
+        so all addresses and masks are constants.'''
+
+        namespace = {}
+        source = 'lambda data: {0}'.format(self._get_source(namespace))
+
+        return eval(source, namespace)  # pylint: disable=eval-used
+
+
+    def _get_dtype(self):
+        '''Return the NumPy dtype string for the value of this item or None if the
+        value cannot be represented by a NumPy scalar type.'''
+
+        return None
+
+
+    def _check_data(self, data):
+        '''Raise a ValueError if the data is too short to contain this item.'''
+
+        # the end of the covering byte range is the minimum data length
+        if len(data) < self._byte_end:
+            raise ValueError("Data too short in data item '{0}'.".format(self.name))
 
 
     def get_bit(self, abs_bit):
@@ -67,27 +246,15 @@ class DataItem():
         '''Extract the data area specified by start and length values into a bytes()
         structure.'''
 
-        bytelist = []
-        bit_count = 0
-        byte_val = 0
-
-        # end + 1, because for range, the top value is not reached
-        for addr in range(self.start, self.end + 1):
-            bit_val = self.get_bit(addr)
-
-            # shift it to the correct output position
-            byte_val += bit_val << (bit_count % 8)
-
-            bit_count += 1
-            if bit_count == 8:
-                bytelist.append(byte_val)
-                byte_val = 0
-                bit_count = 0
+        if self._is_aligned:
+            # byte-aligned items are a plain slice of the input data
+            return bytes(self._data[self._slice])
 
-        if bit_count != 0:
-            bytelist.append(byte_val)
+        # Shift the covering bytes as one integer instead of copying bit by bit.
+        val = int.from_bytes(self._data[self._slice], 'little')
+        val = (val >> self._shift) & self._mask
 
-        return bytes(bytelist)
+        return val.to_bytes(self._raw_len, 'little')
 
 
     def calc_value(self):
@@ -116,7 +283,7 @@ class DataItem():
 
         '''
 
-        return self.start + self.length - 1
+        return self._end
 
 
     @property
@@ -131,9 +298,17 @@ class DataItem():
         '''The raw value of this data item. This is a bytes() object containing the data
         belonging to this data item.'''
 
-        if self._data is None:
+        if self._binmap is not None:
+            self._binmap._sync_item(self)
+
+        if not self._set:
             raise ValueError('No data set.')
 
+        # subclasses which calculate the value directly from the data only
+        # extract the raw value on request
+        if self._raw_value is None:
+            self._raw_value = self.extract_raw_value()
+
         return self._raw_value
 
 
@@ -141,7 +316,10 @@ class DataItem():
     def value(self):
         '''The interpreted value of this data item.'''
 
-        if self._data is None:
+        if self._binmap is not None:
+            self._binmap._sync_item(self)
+
+        if not self._set:
             raise ValueError('No data set.')
 
         return self._value
@@ -157,12 +335,10 @@ class DataItem():
     def __str__(self):
         '''Convert the data item to string.'''
 
-        raw_str = ' '.join('0x{0:02x}'.format(v) for v in self.raw_value)
+        raw_str = '0x' + self.raw_value.hex(' ').replace(' ', ' 0x')
 
-        return '{addr}+{length} {name} = {value} [raw: {r}]'.format(
-            addr=format_addr(self.start),
-            name=self._name,
-            length=self._length,
+        return '{prefix}{value} [raw: {r}]'.format(
+            prefix=self._str_prefix,
             value=self.value,
             r=raw_str)
 
@@ -170,52 +346,268 @@ class DataItem():
 class CharDataItem(DataItem):
     '''DataItem subclass for string interpretation.'''
 
+    __slots__ = ('_encoding',)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
         self._encoding = kwargs.get('encoding', 'ascii')
 
 
+    def set_data(self, data):
+        if not self._is_aligned:
+            super().set_data(data)
+            return
+
+        self._check_data(data)
+
+        # decode directly from the data, the raw value is extracted on request
+        value = str(data[self._slice], self._encoding)
+        self._set_value(data, value)
+
+
     def calc_value(self):
-        return self._raw_value.decode('ascii')
+        return self._raw_value.decode(self._encoding)
+
+
+    def _get_source(self, namespace):
+        if self._is_aligned:
+            return 'str(data[{0}:{1}], {2!r})'.format(
+                self._byte_start, self._byte_end, self._encoding)
+
+        return '{0}.decode({1!r})'.format(self._get_raw_source(), self._encoding)
+
+
+    def _get_struct_code(self):
+        return None
 
 
 class UIntDataItem(DataItem):
     '''DataItem subclass for unsigned integer interpretation.'''
 
+    __slots__ = ('_endian', '_from_bits', '_native')
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
         self._endian = kwargs.get('endian', 'little')
+        check_endian(self._endian)
 
-        if self._endian not in ('little', 'big'):
-            msg = (
-                "Parameter 'endian' must be either 'big' or 'little' endian. "
-                "Got '{0}'."
-            )
-            raise ValueError(msg.format(self._endian))
+        # The value of unaligned items is the shifted and masked bitfield
+        # itself, unless the bytes of the raw value are swapped for big endian.
+        self._from_bits = not self._is_aligned and (
+            (self._endian == 'little') or (self._length <= 8))
 
+        # the compiled extractor handles bitfields up to 64 bits incl. shift
+        self._native = (
+            self._from_bits
+            and (_extract_bits is not None)
+            and (self._shift + self._length <= 64))
 
-    def calc_value(self):
-        if self._endian == 'big':
-            raw_val = reversed(self._raw_value)
+
+    def set_data(self, data):
+        if not self._from_bits:
+            super().set_data(data)
+            return
+
+        self._check_data(data)
+
+        # calculate the value without the round-trip through the raw value
+        if self._native:
+            val = _extract_bits(data, self._start, self._length)
         else:
-            raw_val = self._raw_value
+            val = int.from_bytes(data[self._slice], 'little')
+            val = (val >> self._shift) & self._mask
+
+        self._set_value(data, self._from_int(val))
+
+
+    def _set_bits(self, data, bits):
+        if not self._from_bits:
+            super()._set_bits(data, bits)
+            return
+
+        # the bitfield is the value, the raw value is extracted on request
+        self._set_value(data, self._from_int(bits))
+
+
+    def calc_value(self):
+        return self._from_int(int.from_bytes(self._raw_value, self._endian))
+
 
-        val = 0
-        for byte_pos, byte_val in enumerate(raw_val):
-            val += (1 << (8 * byte_pos)) * byte_val
+    def _from_int(self, val):
+        '''Convert the unsigned integer value to the value of this item.'''
 
         return val
 
 
+    def _get_source(self, namespace):
+        if (self._endian == 'little') or (self._length <= 8):
+            return self._get_int_source()
+
+        if self._is_aligned and (self._length == 16):
+            return '((data[{0}] << 8) | data[{1}])'.format(
+                self._byte_start, self._byte_start + 1)
+
+        if self._is_aligned:
+            return "int.from_bytes(data[{0}:{1}], 'big')".format(
+                self._byte_start, self._byte_end)
+
+        return "int.from_bytes({0}, 'big')".format(self._get_raw_source())
+
+
+    def _get_struct_code(self):
+        return None
+
+
+class FastUIntDataItem(UIntDataItem):
+    '''UIntDataItem for byte-aligned 8, 16, 32 and 64 bit integers. The value is
+    read with a single struct unpack call and the raw value is only extracted
+    when requested.'''
+
+    __slots__ = ('_code', '_unpack_from')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        if not self.fits(self._start, self._length):
+            msg = (
+                "Data item '{0}' must be byte-aligned and 8, 16, 32 or 64 bits "
+                "long."
+            )
+            raise ValueError(msg.format(self._name))
+
+        self._code = _UINT_CODES[self._length]
+        self._unpack_from = _UINT_UNPACKERS[(self._length, self._endian)]
+
+
+    @classmethod
+    def fits(cls, start, length):
+        '''Return True if an item with the given start address and length can be
+        represented by this class.'''
+
+        return (start is not None) and (start % 8 == 0) and (length in _UINT_CODES)
+
+
+    def set_data(self, data):
+        self._check_data(data)
+
+        self._set_value(data, self._unpack_from(data, self._byte_start)[0])
+
+
+    def _get_source(self, namespace):
+        # indexing single bytes is faster for 8 and 16 bit integers
+        if self._length <= 16:
+            return super()._get_source(namespace)
+
+        unpack_name = '_unpack_{0}_{1}'.format(self._code, self._endian)
+        namespace[unpack_name] = self._unpack_from
+
+        return '{0}(data, {1})[0]'.format(unpack_name, self._byte_start)
+
+
+    def _get_struct_code(self):
+        if self._endian == 'little':
+            return self._code
+
+        return None
+
+
+    def _get_dtype(self):
+        byte_order = '<' if self._endian == 'little' else '>'
+        return '{0}u{1}'.format(byte_order, self._length // 8)
+
+
 class BoolDataItem(UIntDataItem):
     '''DataItem subclass for bool value interpretation. This first converts the
     underlying value to an unstigned integer. Any value not equal zero is
     interpreted as True, zero is interpreted as false.'''
 
-    def calc_value(self):
-        val = super().calc_value()
+    __slots__ = ()
+
+    def set_data(self, data):
+        # single bits and single bytes are tested directly in the data
+        if self._length == 1:
+            self._check_data(data)
+            self._set_value(data, bool((data[self._byte_start] >> self._shift) & 1))
+        elif self._is_aligned and (self._length == 8):
+            self._check_data(data)
+            self._set_value(data, data[self._byte_start] != 0)
+        else:
+            super().set_data(data)
+
 
+    def _from_int(self, val):
         # Convert the integer value to bool (0: False, everything else: True)
         return bool(val)
+
+
+    def _get_source(self, namespace):
+        if self._length == 1:
+            return 'bool((data[{0}] >> {1}) & 1)'.format(self._byte_start, self._shift)
+
+        if self._is_aligned and (self._length == 8):
+            return '(data[{0}] != 0)'.format(self._byte_start)
+
+        return 'bool({0})'.format(super()._get_source(namespace))
+
+
+class FloatDataItem(DataItem):
+    '''DataItem subclass for 32 bit (single precision) and 64 bit (double
+    precision) floating point interpretation. Byte-aligned values are read with
+    a single struct unpack call and the raw value is only extracted when
+    requested.'''
+
+    __slots__ = ('_endian', '_code', '_struct')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        self._endian = kwargs.get('endian', 'little')
+        check_endian(self._endian)
+
+        if self._length not in _FLOAT_CODES:
+            msg = "Data item '{0}' must be 32 or 64 bits long."
+            raise ValueError(msg.format(self._name))
+
+        self._code = _FLOAT_CODES[self._length]
+        self._struct = _FLOAT_STRUCTS[(self._length, self._endian)]
+
+
+    def set_data(self, data):
+        if not self._is_aligned:
+            super().set_data(data)
+            return
+
+        self._check_data(data)
+
+        self._set_value(data, self._struct.unpack_from(data, self._byte_start)[0])
+
+
+    def calc_value(self):
+        return self._struct.unpack(self._raw_value)[0]
+
+
+    def _get_source(self, namespace):
+        struct_name = '_struct_{0}'.format(len(namespace))
+        namespace[struct_name] = self._struct
+
+        if self._is_aligned:
+            return '{0}.unpack_from(data, {1})[0]'.format(struct_name, self._byte_start)
+
+        return '{0}.unpack({1})[0]'.format(struct_name, self._get_raw_source())
+
+
+    def _get_struct_code(self):
+        if self._is_aligned and (self._endian == 'little'):
+            return self._code
+
+        return None
+
+
+    def _get_dtype(self):
+        if not self._is_aligned:
+            return None
+
+        byte_order = '<' if self._endian == 'little' else '>'
+        return '{0}f{1}'.format(byte_order, self._length // 8)
@@ -1,8 +1,14 @@
 '''Unit tests for BinMap implementation.'''
 
+import array
+import enum
+import struct
+
 import pytest
 
 from .. import BinMap
+from .. import binmap as binmap_module
+from ..dataitems import FastUIntDataItem
 
 
 TESTDATA = bytes([0x12, 0x34, 0x56, 0x78, 0x34, 0x32, 0x30, 0x30, 0x20])
@@ -37,6 +43,19 @@ def test_binmap_setup_missing_param():
     with pytest.raises(KeyError):
         binmap.add(dt='bool1', name='b1')
 
+    with pytest.raises(KeyError):
+        binmap.add(dt=None, name='none')
+
+
+def test_non_str_name():
+    '''Item names do not have to be strings.'''
+
+    binmap = BinMap()
+    binmap.add(dt='uint8', name=1, start=0)
+    binmap.set_data(TESTDATA)
+
+    assert binmap[1] == 0x12
+
 
 def test_binmap_str():
     '''Test string conversion of BinMap instance.'''
@@ -45,6 +64,8 @@ def test_binmap_str():
     # ensure that we can convert to string
     print(binmap)
 
+    assert str(binmap.get_item('answer')) == '0004:0+16 answer = 42 [raw: 0x34 0x32]'
+
 
 TESTSPEC_ALL_DATATYPES = [
     pytest.param({'dt':'raw', 'start':0, 'length':8}, bytes([0x12]), id='raw'),
@@ -67,9 +88,7 @@ def test_all_datatypes(params, result):
 
     binmap = BinMap()
 
-    params['name'] = 'testval'
-
-    binmap.add(**params)
+    binmap.add(name='testval', **params)
     binmap.set_data(TESTDATA)
 
     item = binmap.get_item('testval')
@@ -80,6 +99,370 @@ def test_all_datatypes(params, result):
     assert item.length == item.end - item.start + 1
 
 
+@pytest.mark.parametrize('params', [
+    pytest.param(param.values[0], id=param.id) for param in TESTSPEC_ALL_DATATYPES
+] + [
+    pytest.param({'dt': 'float', 'start': 0}, id='float'),
+    pytest.param({'dt': 'double', 'start': 0}, id='double'),
+])
+def test_all_datatypes_slots(params):
+    '''Data items of all types use __slots__ and have no instance dict.'''
+
+    binmap = BinMap()
+    binmap.add(**dict(params, name='testval'))
+
+    assert not hasattr(binmap.get_item('testval'), '__dict__')
+
+
+def test_unaligned_bitfield():
+    '''Extract a bitfield which is neither byte-aligned nor a multiple of 8 bits
+    long.'''
+
+    binmap = BinMap()
+    binmap.add(dt='uint', name='testval', start=4, length=12)
+    binmap.set_data(TESTDATA)
+
+    item = binmap.get_item('testval')
+
+    assert item.raw_value == bytes([0x41, 0x03])
+    assert item.value == 0x341
+
+
+def test_aligned_uint_raw_value():
+    '''Byte-aligned fixed-width integers still provide their raw value.'''
+
+    binmap = BinMap()
+    binmap.add(dt='uint16', name='aligned', start=8, endian='big')
+    binmap.add(dt='uint16', name='unaligned', start=4)
+    binmap.add(dt='uint', name='generic', start=16, length=32, endian='big')
+    binmap.set_data(TESTDATA)
+
+    assert isinstance(binmap.get_item('generic'), FastUIntDataItem)
+    assert binmap['generic'] == 0x56783432
+
+    assert binmap['aligned'] == 0x3456
+    assert binmap.get_item('aligned').raw_value == bytes([0x34, 0x56])
+    assert binmap['unaligned'] == 0x6341
+
+
+def test_compile():
+    '''A compiled BinMap must return the same values as the item by item
+    interpretation.'''
+
+    binmap = _get_default_binmap()
+    binmap.add(dt='uint16', name='word', start=16)
+    binmap.add(dt='uint8', name='overlap', start=24)
+    binmap.add(dt='uint8', name='big', start=8*6, endian='big')
+    binmap.add(dt='raw', name='tail', start=8*7, length=16)
+    binmap.add(dt='float', name='float_big', start=8, endian='big')
+    binmap.set_data(TESTDATA)
+    expected = list(binmap)
+
+    binmap.compile()
+    binmap.set_data(TESTDATA)
+
+    assert list(binmap) == expected
+    assert binmap.get_item('word').raw_value == bytes([0x56, 0x78])
+
+
+def test_compile_data_too_short():
+    '''A compiled BinMap reports too short data like the items do.'''
+
+    binmap = _get_default_binmap()
+    binmap.compile()
+
+    with pytest.raises(ValueError):
+        binmap.set_data(TESTDATA[:5])
+
+
+@pytest.mark.parametrize('backend', ['python', 'numba'])
+def test_compile_bitfields(backend, monkeypatch):
+    '''Unaligned bitfields extracted by a compiled BinMap must match the item by
+    item interpretation, with and without the numba kernel.'''
+
+    if backend == 'numba':
+        pytest.importorskip('pybinmap._numba_kernel')
+    else:
+        monkeypatch.setattr(binmap_module, '_import_numba_kernel', lambda: None)
+
+    binmap = _get_default_binmap()
+    binmap.add(dt='uint', name='nibbles', start=4, length=12)
+    binmap.add(dt='uint', name='wide', start=3, length=61)
+    binmap.set_data(TESTDATA)
+    expected = list(binmap)
+
+    binmap.compile()
+    binmap.set_data(TESTDATA)
+
+    assert binmap.get_item('nibbles') in binmap._bit_items
+    assert list(binmap) == expected
+
+
+def test_add_from_spec():
+    '''Items added from a spec are sorted by start address like single items.'''
+
+    binmap = BinMap()
+    binmap.add(dt='uint8', name='second', start=8)
+    binmap.add_from_spec([
+        {'dt': 'uint8', 'name': 'third', 'start': 16},
+        {'dt': 'uint8', 'name': 'first', 'start': 0},
+    ])
+    binmap.add(dt='uint8', name='fourth', start=24)
+    binmap.set_data(TESTDATA)
+
+    assert [name for name, _ in binmap] == ['first', 'second', 'third', 'fourth']
+
+
+def test_get_spec_round_trip():
+    '''A BinMap restored from its spec interprets data the same way.'''
+
+    binmap = _get_default_binmap()
+
+    restored = BinMap()
+    restored.add_from_spec(binmap.get_spec())
+    restored.set_data(TESTDATA)
+
+    assert list(restored) == list(binmap)
+
+
+def test_set_data_buffer():
+    '''Data can be passed as any object supporting the buffer protocol.'''
+
+    binmap = _get_default_binmap()
+    expected = list(binmap)
+
+    data = array.array('H', TESTDATA[:8])
+    binmap.set_data(data)
+    assert list(binmap) == expected
+
+    # the BinMap does not keep the buffer exported
+    data.append(0)
+
+    binmap.set_data(list(TESTDATA))
+    assert list(binmap) == expected
+
+    binmap.compile()
+    binmap.set_data(memoryview(TESTDATA))
+    assert list(binmap) == expected
+
+
+def test_utf8():
+    '''Strings are decoded with the encoding of their data type.'''
+
+    binmap = BinMap()
+    binmap.add(dt='utf8', name='aligned', start=0, length=8*4)
+    binmap.add(dt='utf8', name='unaligned', start=8*4+4, length=8*2)
+    binmap.set_data('äö'.encode('utf-8') + bytes([0x30, 0x4c, 0x0a]))
+
+    assert binmap['aligned'] == 'äö'
+    assert binmap['unaligned'] == 'ä'
+    assert binmap.get_item('aligned').raw_value == 'äö'.encode('utf-8')
+
+    binmap.freeze()
+    binmap.set_data('äö'.encode('utf-8') + bytes([0x30, 0x4c, 0x0a]))
+
+    assert binmap['aligned'] == 'äö'
+    assert binmap['unaligned'] == 'ä'
+
+
+def test_bool():
+    '''Single bits are interpreted LSB first, i.e. bit 0 is the lowest bit of
+    the first byte.'''
+
+    binmap = BinMap()
+    for bit in range(16):
+        binmap.add(dt='bool1', name='bit{0}'.format(bit), start=bit)
+    binmap.add(dt='bool8', name='byte', start=8)
+    binmap.add(dt='bool', name='wide', start=4, length=4)
+    binmap.set_data(TESTDATA)
+
+    # 0x12, 0x34
+    assert [binmap['bit{0}'.format(bit)] for bit in range(16)] == [
+        bool(int(c)) for c in reversed('0011010000010010')]
+    assert binmap['byte'] is True
+    assert binmap['wide'] is True
+    assert binmap.get_item('bit1').raw_value == bytes([0x01])
+
+
+def test_float():
+    '''Interpret aligned and unaligned floating point values.'''
+
+    shifted = int.from_bytes(struct.pack('>f', -2.25), 'little') << 4
+
+    binmap = BinMap()
+    binmap.add(dt='float', name='single', start=0)
+    binmap.add(dt='double', name='double', start=32, endian='big')
+    binmap.add(dt='float', name='shifted', start=8*12+4, endian='big')
+    binmap.set_data(
+        struct.pack('<f', 1.5) + struct.pack('>d', 0.1) + shifted.to_bytes(5, 'little'))
+
+    assert binmap['single'] == 1.5
+    assert binmap['double'] == 0.1
+    assert binmap['shifted'] == -2.25
+    assert binmap.get_item('single').raw_value == struct.pack('<f', 1.5)
+
+
+def test_freeze():
+    '''A frozen BinMap must return the same values as the item by item
+    interpretation.'''
+
+    binmap = BinMap()
+    for params in TESTSPEC_ALL_DATATYPES:
+        spec = dict(params.values[0], name=params.id)
+        binmap.add(**spec)
+    binmap.add(dt='uint', name='nibbles', start=4, length=12)
+    binmap.add(dt='uint', name='nibbles_big', start=4, length=12, endian='big')
+    binmap.add(dt='uint16', name='word_big', start=8, endian='big')
+    binmap.add(dt='uint32', name='dword_big', start=8, endian='big')
+    binmap.add(dt='double', name='double', start=8)
+    binmap.add(dt='float', name='float_unaligned', start=3)
+    binmap.set_data(TESTDATA)
+    expected = list(binmap)
+
+    binmap.freeze()
+    binmap.set_data(TESTDATA)
+
+    assert list(binmap) == expected
+    assert binmap.get_value_dict() == dict(expected)
+    assert binmap['nibbles'] == 0x341
+    assert binmap.get_item('nibbles').value == 0x341
+
+    # items follow changes of the data
+    binmap.set_data(bytes(len(TESTDATA)))
+    assert binmap.get_item('nibbles').value == 0
+    assert binmap.get_item('nibbles').value == 0
+
+
+def test_freeze_names():
+    '''Frozen BinMaps support names without literal representation and
+    duplicate names like unfrozen ones.'''
+
+    class Name(enum.Enum):
+        '''Enum to use its members as item names.'''
+        FIRST = 1
+
+    binmap = BinMap()
+    binmap.add(dt='uint8', name=Name.FIRST, start=0)
+    binmap.add(dt='uint8', name=float('inf'), start=8)
+    binmap.add(dt='uint8', name='twice', start=16)
+    binmap.add(dt='uint8', name='twice', start=24)
+    binmap.set_data(TESTDATA)
+    expected = list(binmap)
+    expected_dict = binmap.get_value_dict()
+    expected_twice = binmap['twice']
+
+    binmap.freeze()
+    binmap.set_data(TESTDATA)
+
+    assert list(binmap) == expected
+    assert binmap.get_value_dict() == expected_dict
+    assert binmap['twice'] == expected_twice
+    assert binmap[Name.FIRST] == 0x12
+
+
+def test_freeze_held_item():
+    '''Items fetched from a frozen BinMap follow later set_data() calls.'''
+
+    binmap = BinMap()
+    binmap.add(dt='uint8', name='a', start=0)
+    binmap.set_data(b'\x01')
+    item = binmap.get_item('a')
+    items = list(binmap.items())
+
+    binmap.freeze()
+    binmap.set_data(b'\x02')
+    assert item.value == 2
+    assert items[0].raw_value == b'\x02'
+
+    binmap.set_data(b'\x03')
+    assert item.value == 3
+    assert binmap['a'] == 3
+
+
+def test_freeze_add_after_set_data():
+    '''Items added to a frozen BinMap after set_data() have no data, while the
+    other items keep their values.'''
+
+    binmap = _get_default_binmap()
+    binmap.freeze()
+    binmap.set_data(TESTDATA)
+    binmap.add(dt='uint8', name='new', start=16*8)
+
+    with pytest.raises(ValueError):
+        _ = binmap['new']
+
+    # the data is too short for the new item, but it is not interpreted
+    assert len(list(binmap.items())) == 4
+    assert binmap['testval'] == 0x34
+
+    with pytest.raises(ValueError):
+        _ = binmap.get_item('new').value
+
+
+def test_set_data_mutable_buffer():
+    '''Changes to a buffer after set_data() do not affect the values.'''
+
+    binmap = _get_default_binmap()
+    binmap.freeze()
+
+    data = bytearray(TESTDATA)
+    binmap.set_data(data)
+    data[1] = 0xff
+
+    assert binmap['testval'] == 0x34
+    assert binmap.get_item('testval').value == 0x34
+    assert binmap.get_item('testval').raw_value == bytes([0x34])
+
+
+def test_item_mutable_buffer():
+    '''The raw value of an item matches its value, also if the data passed
+    to the item changes afterwards.'''
+
+    item = FastUIntDataItem(dt='uint8', name='byte', start=8, length=8)
+    data = bytearray(TESTDATA)
+    item.set_data(data)
+    data[1] = 0xff
+
+    assert item.value == 0x34
+    assert item.raw_value == bytes([0x34])
+
+
+def test_values_as_ndarray():
+    '''Interpret several records as NumPy structured array.'''
+
+    np = pytest.importorskip('numpy')
+
+    binmap = _get_default_binmap()
+    binmap.add(dt='uint16', name='word', start=16, endian='big')
+    binmap.add(dt='uint8', name='last', start=8*8)
+
+    records = binmap.values_as_ndarray(TESTDATA + TESTDATA)
+
+    assert records.shape == (2,)
+    assert records.dtype.names == ('testval', 'word', 'last')
+    assert list(records['word']) == [0x5678] * 2
+    assert list(records['last']) == [0x20] * 2
+    assert isinstance(records['last'][0], np.uint8)
+
+
+def test_bitops_extract():
+    '''The compiled bit extractor matches the pure Python extraction.'''
+
+    bitops = pytest.importorskip('pybinmap._bitops')
+
+    data = bytes(range(0x80, 0x90))
+    for start, length in (
+            (0, 8), (3, 5), (13, 20), (7, 57), (0, 64), (100, 20)):
+        bs, be = start // 8, (start + length + 7) // 8
+        expected = int.from_bytes(data[bs:be], 'little') >> (start % 8)
+        expected &= (1 << length) - 1
+
+        assert bitops.extract(data, start, length) == expected
+
+    with pytest.raises(ValueError):
+        bitops.extract(data, 4, 64)
+
+
 def test_fill_unmapped():
     '''Test function to add raw data items for all unmapped areas.'''
 
@@ -115,6 +498,23 @@ def test_fill_unmapped_with_end_address():
     assert um3.end == 800
 
 
+def test_fill_unmapped_overlapping():
+    '''Addresses covered by an enclosing item are not unmapped.'''
+
+    binmap = BinMap()
+    binmap.add(dt='uint32', name='outer', start=0)
+    binmap.add(dt='uint8', name='inner', start=8)
+    binmap.add(dt='uint8', name='last', start=40)
+    binmap.fill_unmapped()
+
+    um0 = binmap.get_item('unmapped_000')
+    assert um0.start == 32
+    assert um0.end == 39
+
+    with pytest.raises(KeyError):
+        binmap.get_item('unmapped_001')
+
+
 def test_dict_access():
     '''Test successful dict based access to binmap information.'''
 
@@ -124,6 +524,15 @@ def test_dict_access():
     assert binmap['testval'] == 0x34
 
 
+def test_get_value_dict():
+    '''The value dict is ordered by start address.'''
+
+    binmap = _get_default_binmap()
+
+    assert list(binmap.get_value_dict().items()) == [
+        ('enabled', True), ('testval', 0x34), ('answer', '42')]
+
+
 def test_dict_access_non_existent_element():
     '''Test unsuccessful dict based access to binmap information.'''
 
@@ -132,6 +541,22 @@ def test_dict_access_non_existent_element():
     with pytest.raises(KeyError):
         _ = binmap['non_existent_value']
 
+    with pytest.raises(KeyError):
+        binmap.get_value('non_existent_value')
+
+    with pytest.raises(KeyError):
+        binmap.get_item('non_existent_value')
+
+
+def test_dict_access_without_data():
+    '''Accessing values before setting data fails.'''
+
+    binmap = BinMap()
+    binmap.add(dt='uint8', name='testval', start=0)
+
+    with pytest.raises(ValueError):
+        _ = binmap['testval']
+
 
 def test_binmap_iterator():
     '''Test to iterate over the key,value tuples in binmap.'''
@@ -2,6 +2,18 @@
 
 import setuptools
 
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    # without Cython, pybinmap uses its pure Python bitfield extraction
+    ext_modules = []
+else:
+    ext_modules = cythonize(['pybinmap/_bitops.pyx'], language_level=3)
+
+    # a missing compiler must not break the installation
+    for ext in ext_modules:
+        ext.optional = True
+
 with open("README.md", "r") as fh:
     long_description = fh.read()
 
@@ -15,4 +27,6 @@ setuptools.setup(
     author_email='andreas@a-netz.de',
     url='https://github.com/motlib/pybinmap',
     packages=['pybinmap'],
+    ext_modules=ext_modules,
+    python_requires='>=3.8',
 )